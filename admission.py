@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def rss_bytes() -> int:
+    """Resident memory of this process, 0 if it can't be read."""
+
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class AdmissionController:
+    """Decides when a heavy pack job may start.
+
+    Jobs wait in a FIFO queue until there is a free slot and the bot is not
+    under pressure: in-flight pack bytes, RSS and event loop lag must be under
+    their limits (a limit of 0 disables the check). When nothing is running
+    the RSS limit is ignored, so a high baseline can't stall the queue. Once
+    `max_queued` jobs are waiting `full` is True and new jobs should be
+    rejected.
+
+    Waiters are woken when a job ends or pack bytes are released. Only the
+    head of the queue blocked by pressure polls every `poll_interval`, since
+    RSS and loop lag change without notice.
+
+    Example:
+        ```python
+         if admission.full():
+             return
+         async with admission:
+             ...
+        ```
+    """
+
+    def __init__(
+        self,
+        max_jobs: int,
+        max_queued: int,
+        max_pack_bytes: int = 0,
+        max_rss: int = 0,
+        max_loop_lag: float = 0,
+        poll_interval: float = 1,
+    ):
+        self.max_jobs = max_jobs
+        self.max_queued = max_queued
+        self.max_pack_bytes = max_pack_bytes
+        self.max_rss = max_rss
+        self.max_loop_lag = max_loop_lag
+        self.poll_interval = poll_interval
+
+        self.running = 0
+        self.pack_bytes = 0
+        self.loop_lag = 0.0
+        self._queue = deque()
+        self._changed = asyncio.Event()
+
+    def hold(self, nbytes: int):
+        """Account `nbytes` of pack data kept in memory."""
+        self.pack_bytes += nbytes
+
+    def release(self, nbytes: int):
+        self.pack_bytes = max(0, self.pack_bytes - nbytes)
+        self._changed.set()
+
+    def pressure(self, check_rss: bool = True) -> Optional[str]:
+        """Return why the bot is under pressure, None if it isn't."""
+
+        if self.max_pack_bytes and self.pack_bytes >= self.max_pack_bytes:
+            return f"pack bytes {self.pack_bytes}"
+
+        if self.max_loop_lag and self.loop_lag >= self.max_loop_lag:
+            return f"event loop lag {self.loop_lag:.3f}s"
+
+        if check_rss and self.max_rss:
+            rss = rss_bytes()
+            if rss >= self.max_rss:
+                return f"rss {rss}"
+
+        return None
+
+    def full(self) -> bool:
+        return len(self._queue) >= self.max_queued
+
+    def _has_slot(self, token) -> bool:
+        return self._queue[0] is token and self.running < self.max_jobs
+
+    async def acquire(self):
+
+        token = object()
+        self._queue.append(token)
+
+        logged = False
+        try:
+            while True:
+                timeout = None
+
+                if self._has_slot(token):
+                    reason = self.pressure(check_rss=bool(self.running))
+
+                    if not reason:
+                        break
+
+                    if not logged:
+                        logger.info("Pack job waiting, under pressure: %s", reason)
+                        logged = True
+
+                    timeout = self.poll_interval
+
+                self._changed.clear()
+
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._queue.remove(token)
+            # The next job in the queue may start too
+            self._changed.set()
+
+        self.running += 1
+
+    def try_acquire(self) -> bool:
+        """Take a slot only if it is free right now, nobody is waiting and
+        the bot is not under pressure. For optional work like prewarming."""
+
+        if self._queue or self.running >= self.max_jobs or self.pressure():
+            return False
+
+        self.running += 1
+        return True
+
+    def done(self):
+        self.running -= 1
+        self._changed.set()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.done()
+
+    def record_loop_lag(self, lag: float):
+        """Feed a sample of how late the event loop woke up."""
+
+        # Keep spikes visible for a while instead of only the last sample
+        self.loop_lag = max(lag, self.loop_lag * 0.5)
@@ -0,0 +1,80 @@
+import time
+from collections import Counter, OrderedDict
+
+
+class TTLCache:
+    """In-memory cache whose entries expire `ttl` seconds after being set.
+
+    Example:
+        ```python
+         sticker_sets = TTLCache(ttl=3600, maxsize=128)
+         sticker_sets.set("Animals", sticker_set)
+         sticker_sets.get("Animals")
+        ```
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 128):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+
+        item = self._data.get(key)
+
+        if item is None:
+            return default
+
+        expires, value = item
+
+        if expires < time.monotonic():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+
+        item = self._data.pop(key, None)
+
+        return default if item is None else item[1]
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self._data)
+
+
+class Popularity:
+    """Counts how often a key is seen. `decay` scales every score down so
+    old trends fade out and the ranking follows what is hot right now."""
+
+    def __init__(self):
+        self._scores = Counter()
+
+    def hit(self, key, weight: float = 1):
+        self._scores[key] += weight
+
+    def forget(self, key):
+        self._scores.pop(key, None)
+
+    def top(self, n: int):
+        return [key for key, _ in self._scores.most_common(n)]
+
+    def decay(self, factor: float = 0.5, threshold: float = 0.5):
+
+        for key in list(self._scores):
+            self._scores[key] *= factor
+
+            if self._scores[key] < threshold:
+                del self._scores[key]
@@ -0,0 +1,123 @@
+import json
+import logging
+import os
+import shutil
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PackJob:
+    """A sticker pack download requested from the message `message_id`."""
+
+    set_name: str
+    chat_id: int
+    message_id: int
+    sent_parts: List[int] = field(default_factory=list)
+
+    @property
+    def id(self):
+        return f"{self.chat_id}_{self.message_id}"
+
+
+class JobStore:
+    """Keeps pack jobs and their progress on disk so they survive restarts.
+
+    Layout:
+        ```
+         <root>/<job id>/job.json                 job state
+         <root>/<job id>/part<N>/sticker_<i>.<ext> converted stickers of part N
+         <root>/<job id>/<set name>.part<N>.wastickers finished zip of part N
+        ```
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _job_dir(self, job: PackJob):
+        return os.path.join(self.root, job.id)
+
+    def _part_dir(self, job: PackJob, part: int):
+        return os.path.join(self._job_dir(job), f"part{part}")
+
+    def _write(self, path: str, data: bytes):
+        """Write `data` so that a crash never leaves a half written file."""
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def save(self, job: PackJob):
+        self._write(
+            os.path.join(self._job_dir(job), "job.json"),
+            json.dumps(asdict(job)).encode(),
+        )
+
+    def remove(self, job: PackJob):
+        shutil.rmtree(self._job_dir(job), ignore_errors=True)
+
+    def load(self, job_id: str) -> Optional[PackJob]:
+
+        job_dir = os.path.join(self.root, job_id)
+
+        if not os.path.isdir(job_dir):
+            return None
+
+        try:
+            with open(os.path.join(job_dir, "job.json"), "rb") as f:
+                return PackJob(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            logger.error("Discarding unreadable job %s", job_id)
+            shutil.rmtree(job_dir, ignore_errors=True)
+            return None
+
+    def load_all(self) -> List[PackJob]:
+
+        if not os.path.isdir(self.root):
+            return []
+
+        jobs = [self.load(name) for name in sorted(os.listdir(self.root))]
+
+        return [job for job in jobs if job]
+
+    def save_sticker(self, job: PackJob, part: int, filename: str, data: bytes):
+        self._write(os.path.join(self._part_dir(job, part), filename), data)
+
+    def load_stickers(self, job: PackJob, part: int) -> Dict[int, Tuple[str, bytes]]:
+        """Return the converted stickers of `part` by their index in the part."""
+
+        part_dir = self._part_dir(job, part)
+
+        if not os.path.isdir(part_dir):
+            return {}
+
+        stickers = {}
+        for filename in os.listdir(part_dir):
+            if not filename.startswith("sticker_") or filename.endswith(".tmp"):
+                continue
+
+            index = int(filename.split("_")[1].split(".")[0])
+
+            with open(os.path.join(part_dir, filename), "rb") as f:
+                stickers[index] = (filename, f.read())
+
+        return stickers
+
+    def save_part(self, job: PackJob, filename: str, part: int, data: bytes):
+        """Store the zip of `part`, its converted stickers are no longer needed."""
+
+        self._write(os.path.join(self._job_dir(job), filename), data)
+        shutil.rmtree(self._part_dir(job, part), ignore_errors=True)
+
+    def load_part(self, job: PackJob, filename: str) -> Optional[bytes]:
+
+        try:
+            with open(os.path.join(self._job_dir(job), filename), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
@@ -1,9 +1,11 @@
+import asyncio
 import html
+import io
 import json
 import logging
 import traceback
 from datetime import timedelta
-from functools import wraps
+from functools import partial, wraps
 from random import choice
 from uuid import uuid4
 
@@ -14,11 +16,13 @@ from telegram import (
     InlineKeyboardMarkup,
     InlineQueryResultArticle,
     InputTextMessageContent,
+    ReplyParameters,
     Update,
 )
 from telegram.constants import ChatAction, ChatType, MessageOriginType, ParseMode
-from telegram.error import TimedOut
+from telegram.error import NetworkError, TelegramError, TimedOut
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     CallbackQueryHandler,
     CommandHandler,
@@ -28,7 +32,20 @@ from telegram.ext import (
     filters,
 )
 
-from utils import chunks, create_zip, file_size, make_thumbnail, resize_image, text_html
+from admission import AdmissionController
+from cache import Popularity, TTLCache
+from jobs import JobStore, PackJob
+from media_groups import MediaGroupAggregator
+from profiling import LoopWatchdog, is_profiling, profile
+from utils import (
+    chunks,
+    create_zip,
+    file_size,
+    make_thumbnail,
+    pack_filename,
+    resize_image,
+    text_html,
+)
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
@@ -40,6 +57,45 @@ logger = logging.getLogger(__name__)
 
 BOT_TOKEN = config("BOT_TOKEN")
 DEVELOPER_CHAT_ID = config("DEVELOPER_CHAT_ID", default=None)
+STICKER_SET_TTL = config("STICKER_SET_TTL", default=3600, cast=int)
+PACK_CACHE_SIZE = config("PACK_CACHE_SIZE", default=5, cast=int)
+PREWARM_INTERVAL = config("PREWARM_INTERVAL", default=600, cast=int)
+PREWARM_TOP = config("PREWARM_TOP", default=3, cast=int)
+JOBS_DIR = config("JOBS_DIR", default="data/jobs")
+SHUTDOWN_TIMEOUT = config("SHUTDOWN_TIMEOUT", default=50, cast=int)
+MAX_PACK_JOBS = config("MAX_PACK_JOBS", default=2, cast=int)
+MAX_QUEUED_JOBS = config("MAX_QUEUED_JOBS", default=10, cast=int)
+MAX_PACK_MB = config("MAX_PACK_MB", default=100, cast=int)
+MAX_RSS_MB = config("MAX_RSS_MB", default=400, cast=int)
+MAX_LOOP_LAG = config("MAX_LOOP_LAG", default=0.5, cast=float)
+PROFILE_MAX_SECONDS = config("PROFILE_MAX_SECONDS", default=300, cast=int)
+LOOP_BLOCK_THRESHOLD = config("LOOP_BLOCK_THRESHOLD", default=0.25, cast=float)
+MEDIA_GROUP_DELAY = config("MEDIA_GROUP_DELAY", default=1.0, cast=float)
+
+# StickerSet metadata by set name
+sticker_sets = TTLCache(ttl=STICKER_SET_TTL)
+# Converted packs by set name, as a list of (filename, zip bytes) parts
+sticker_packs = TTLCache(ttl=STICKER_SET_TTL, maxsize=PACK_CACHE_SIZE)
+# Set names seen in stickers and download clicks
+popular_sets = Popularity()
+# Pack jobs checkpointed on disk and the tasks running them by job id
+job_store = JobStore(JOBS_DIR)
+pack_jobs = {}
+# Set on shutdown, pack jobs stop at the next checkpoint
+stopping = asyncio.Event()
+# Only pack jobs go through admission, the info handlers are always served
+admission = AdmissionController(
+    max_jobs=MAX_PACK_JOBS,
+    max_queued=MAX_QUEUED_JOBS,
+    max_pack_bytes=MAX_PACK_MB * 1024 * 1024,
+    max_rss=MAX_RSS_MB * 1024 * 1024,
+    max_loop_lag=MAX_LOOP_LAG,
+)
+# Measures the event loop lag for admission and reports callbacks blocking
+# the loop, the bot is set in post_init
+watchdog = LoopWatchdog(
+    threshold=LOOP_BLOCK_THRESHOLD, on_lag=admission.record_loop_lag
+)
 
 
 def send_action(action):
@@ -58,6 +114,44 @@ def send_action(action):
     return decorator
 
 
+def media_group(describe):
+    """Buffers messages of a media group to answer them with one summary,
+    `describe` returns the (title, details, size) of the message."""
+
+    def decorator(func):
+        @wraps(func)
+        async def handler(update, context, *args, **kwargs):
+            if update.message.media_group_id:
+                flush = albums.add(
+                    update.message.media_group_id,
+                    (update, describe(update.message)),
+                )
+
+                # Routes errors to error_handler and stop() answers pending albums
+                if flush:
+                    context.application.create_task(flush, update=update)
+
+                return None
+            return await func(update, context, *args, **kwargs)
+
+        return handler
+
+    return decorator
+
+
+def download_markup(set_name: str):
+
+    return InlineKeyboardMarkup(
+        [
+            [
+                InlineKeyboardButton(
+                    text="⬇️ Download pack", callback_data=f"ds:{set_name}"
+                )
+            ]
+        ]
+    )
+
+
 def forwarded_messages(update: Update):
     """Process forwarded messages"""
 
@@ -205,6 +299,9 @@ async def sticker_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     logger.info("Sticker: %s", sticker)
 
+    if sticker.set_name:
+        popular_sets.hit(sticker.set_name)
+
     file = await update.message.effective_attachment.get_file()
 
     file_bytearray = await file.download_as_bytearray()
@@ -234,18 +331,70 @@ async def sticker_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await update.message.reply_text(
         text=f"{forwarded_info}\n\n{text}" if forwarded_info else text,
         parse_mode="HTML",
-        reply_markup=InlineKeyboardMarkup(
-            [
-                [
-                    InlineKeyboardButton(
-                        text="⬇️ Download pack", callback_data=f"ds:{sticker.set_name}"
-                    )
-                ]
-            ]
-        ),
+        reply_markup=download_markup(sticker.set_name),
     )
 
 
+def describe_photo(message):
+
+    photo = message.photo[-1]
+
+    return "🖼Photo", f"{photo.width}x{photo.height}", photo.file_size or 0
+
+
+def describe_video(message):
+
+    video = message.video
+
+    return (
+        "📼Video",
+        f"{video.width}x{video.height}, {timedelta(seconds=video.duration)}",
+        video.file_size or 0,
+    )
+
+
+def describe_document(message):
+
+    document = message.document
+
+    return "📄Document", document.file_name or "-", document.file_size or 0
+
+
+async def reply_album(items: list) -> None:
+    """Answer all the messages of a media group with a single summary."""
+
+    items.sort(key=lambda item: item[0].message.message_id)
+
+    update = items[0][0]
+
+    logger.info("Media group: %s (%s items)", update.message.media_group_id, len(items))
+
+    forwarded_info = forwarded_messages(update)
+
+    content = [("🗂Album", f"{len(items)} items")]
+
+    for index, (_, (title, details, size)) in enumerate(items, start=1):
+        content.append((f"{index}. {title}", f"{details}, {file_size(size)}"))
+
+    content.append(("Total Size", file_size(sum(item[1][2] for item in items))))
+
+    text = text_html(content)
+
+    await update.get_bot().send_chat_action(
+        chat_id=update.effective_message.chat_id, action=ChatAction.TYPING
+    )
+
+    await update.message.reply_text(
+        text=f"{forwarded_info}\n\n{text}" if forwarded_info else text,
+        parse_mode="HTML",
+    )
+
+
+# Albums arrive as one update per item, they get a single reply
+albums = MediaGroupAggregator(delay=MEDIA_GROUP_DELAY, on_flush=reply_album)
+
+
+@media_group(describe_photo)
 @send_action(ChatAction.TYPING)
 async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
@@ -317,6 +466,7 @@ async def audio_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     )
 
 
+@media_group(describe_document)
 @send_action(ChatAction.TYPING)
 async def document_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
@@ -340,6 +490,7 @@ async def document_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     )
 
 
+@media_group(describe_video)
 @send_action(ChatAction.TYPING)
 async def video_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
@@ -438,38 +589,65 @@ async def poll_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     )
 
 
-@send_action(ChatAction.CHOOSE_STICKER)
-async def download_pack(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-
-    set_name = update.callback_query.data.split(":")[1]
+async def get_sticker_set(bot, set_name: str):
+    """Return the sticker set from cache or fetch it from Telegram."""
 
-    logger.info("Download pack: %s", set_name)
+    sticker_set = sticker_sets.get(set_name)
 
-    try:
-        sticker_set = await context.bot.get_sticker_set(name=set_name)
+    if sticker_set is None:
+        sticker_set = await bot.get_sticker_set(name=set_name)
+        sticker_sets.set(set_name, sticker_set)
 
         logger.info("Sticker set: %s", sticker_set)
-    except TimedOut:
-        logger.error("Timed out while getting the sticker set")
-        await update.callback_query.message.reply_text(
-            text="❌ Error while getting the sticker set"
-        )
-        return
 
-    await update.callback_query.edit_message_reply_markup(
-        reply_markup=InlineKeyboardMarkup(
-            [[InlineKeyboardButton(text="⏳ Downloading...", callback_data="wait")]]
-        )
+    return sticker_set
+
+
+def convertible(sticker_set) -> bool:
+    """Animated and video stickers can't be resized into images."""
+
+    return not any(
+        sticker.is_animated or sticker.is_video for sticker in sticker_set.stickers
     )
 
-    part_number = 1
-    for part in chunks(sticker_set.stickers, 30):
 
-        stickers = []
+async def convert_part(
+    bot,
+    sticker_set,
+    part: list,
+    part_number: int,
+    job: PackJob = None,
+    notify: bool = True,
+):
+    """Download and resize a part of the sticker set and pack it into a zip.
 
-        logger.info("Downloading stickers")
+    With `job` every converted sticker is checkpointed on disk and reused if
+    the part is converted again. With `notify` the developer gets the stickers
+    that can't be resized. Returns None if the bot is shutting down.
+    """
 
+    stickers = []
+    converted = job_store.load_stickers(job, part_number) if job else {}
+
+    logger.info("Downloading stickers")
+
+    held = 0
+    try:
         for index, sticker in enumerate(part, start=1):
+
+            if index in converted:
+                filename, data = converted[index]
+                image = io.BytesIO(data)
+                image.name = filename
+
+                stickers.append({"filename": filename, "file": image})
+                admission.hold(len(data))
+                held += len(data)
+                continue
+
+            if stopping.is_set():
+                return None
+
             try:
                 sticker_file = await sticker.get_file()
                 sticker_file_bytearray = await sticker_file.download_as_bytearray()
@@ -487,61 +665,429 @@ async def download_pack(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
                 logger.info("Image type: %s", sticker_file_type.mime)
                 logger.info("Sticker %s", sticker)
 
-                if DEVELOPER_CHAT_ID:
-                    await context.bot.send_message(
+                if notify and DEVELOPER_CHAT_ID:
+                    await bot.send_message(
                         chat_id=DEVELOPER_CHAT_ID,
                         text="🚫 Error while resizing the sticker",
                     )
-                    await context.bot.send_sticker(
-                        chat_id=DEVELOPER_CHAT_ID, sticker=sticker
-                    )
+                    await bot.send_sticker(chat_id=DEVELOPER_CHAT_ID, sticker=sticker)
 
                 continue
 
             filename = f"sticker_{index}.{sticker_file_extension}"
             image.name = filename
 
+            data = image.getvalue()
+
+            if job:
+                job_store.save_sticker(job, part_number, filename, data)
+
             stickers.append({"filename": filename, "file": image})
+            admission.hold(len(data))
+            held += len(data)
 
-            if index == len(part):
+        if stickers:
 
-                logger.info("Making thumbnail")
-                thumbnail = None
-                while not thumbnail:
-                    thumbnail = await make_thumbnail(choice(stickers)["file"].read())
+            logger.info("Making thumbnail")
+            thumbnail = None
+            while not thumbnail:
+                thumbnail = await make_thumbnail(choice(stickers)["file"].getvalue())
 
-                stickers.append({"filename": "thumbnail.png", "file": thumbnail})
+            stickers.append({"filename": "thumbnail.png", "file": thumbnail})
 
-        zip_buffer = await create_zip(
-            set_name=set_name,
+        return await create_zip(
+            set_name=sticker_set.name,
             part=part_number,
             title=sticker_set.title,
-            bot_username=context.bot.username,
+            bot_username=bot.username,
             stickers=stickers,
         )
-        part_number += 1
+    finally:
+        admission.release(held)
 
-        try:
-            await context.bot.send_chat_action(
-                chat_id=update.effective_message.chat_id,
-                action=ChatAction.UPLOAD_DOCUMENT,
-            )
 
-            logger.info("Sending zip file")
+async def run_pack_job(bot, job: PackJob) -> None:
+    """Convert and send every part of the pack, checkpointing after each step.
+
+    If the bot shuts down the job stops at the next checkpoint and is resumed
+    from there on startup.
+    """
+
+    held = 0
+    try:
+        async with admission:
+
+            if stopping.is_set():
+                return
+
+            sticker_set = await get_sticker_set(bot, job.set_name)
+
+            cached_parts = sticker_packs.get(job.set_name) or []
+
+            parts = []
+            for part_number, part in enumerate(
+                chunks(sticker_set.stickers, 30), start=1
+            ):
+
+                filename = pack_filename(job.set_name, part_number)
+
+                if part_number <= len(cached_parts):
+                    data = cached_parts[part_number - 1][1]
+                else:
+                    data = job_store.load_part(job, filename)
+
+                if data is None:
+                    zip_buffer = await convert_part(
+                        bot, sticker_set, part, part_number, job
+                    )
+
+                    if zip_buffer is None:
+                        logger.info("Job %s stopped at part %s", job.id, part_number)
+                        return
+
+                    data = zip_buffer.getvalue()
+                    job_store.save_part(job, filename, part_number, data)
+
+                parts.append((filename, data))
+                admission.hold(len(data))
+                held += len(data)
+
+                if part_number in job.sent_parts:
+                    continue
 
-            await update.callback_query.message.reply_document(
-                document=zip_buffer,
-                caption=(
-                    "1. Install Sticker Maker to transfer the stickers to WhatsApp.\n"
-                    "Links: [App Store](https://apps.apple.com/ru/app/sticker-maker-studio/id1443326857) "
-                    "or [Google Play](https://play.google.com/store/apps/details?id=com.marsvard.stickermakerforwhatsapp)."
-                ),
-                parse_mode=ParseMode.MARKDOWN,
+                if stopping.is_set():
+                    logger.info("Job %s stopped at part %s", job.id, part_number)
+                    return
+
+                zip_buffer = io.BytesIO(data)
+                zip_buffer.name = filename
+
+                # On a timeout the part stays unsent and is sent again on resume
+                await bot.send_chat_action(
+                    chat_id=job.chat_id, action=ChatAction.UPLOAD_DOCUMENT
+                )
+
+                logger.info("Sending zip file")
+
+                await bot.send_document(
+                    chat_id=job.chat_id,
+                    document=zip_buffer,
+                    caption=(
+                        "1. Install Sticker Maker to transfer the stickers to WhatsApp.\n"
+                        "Links: [App Store](https://apps.apple.com/ru/app/sticker-maker-studio/id1443326857) "
+                        "or [Google Play](https://play.google.com/store/apps/details?id=com.marsvard.stickermakerforwhatsapp)."
+                    ),
+                    parse_mode=ParseMode.MARKDOWN,
+                    reply_parameters=ReplyParameters(
+                        message_id=job.message_id, allow_sending_without_reply=True
+                    ),
+                )
+
+                job.sent_parts.append(part_number)
+                job_store.save(job)
+
+            sticker_packs.set(job.set_name, parts)
+
+            await bot.edit_message_reply_markup(
+                chat_id=job.chat_id, message_id=job.message_id, reply_markup=None
             )
-        except TimedOut:
-            logger.error("Timed out while sending the zip file")
 
-    await update.callback_query.edit_message_reply_markup(reply_markup=None)
+            job_store.remove(job)
+
+    except NetworkError:
+        # Keep the checkpoints, the job resumes on the next click or restart
+        logger.exception("Network error in the pack job %s", job.id)
+
+        await notify_failed_job(
+            bot,
+            job,
+            text="❌ Network error while downloading the sticker pack, try again",
+            reply_markup=download_markup(job.set_name),
+        )
+
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Error while running the pack job %s", job.id)
+
+        job_store.remove(job)
+
+        await notify_failed_job(
+            bot, job, text="❌ Error while downloading the sticker pack"
+        )
+
+    finally:
+        admission.release(held)
+
+
+async def notify_failed_job(bot, job: PackJob, text: str, reply_markup=None) -> None:
+    """Replace the "Downloading..." button and tell the user the job failed."""
+
+    try:
+        await bot.edit_message_reply_markup(
+            chat_id=job.chat_id, message_id=job.message_id, reply_markup=reply_markup
+        )
+        await bot.send_message(chat_id=job.chat_id, text=text)
+    except TelegramError:
+        logger.exception("Error while notifying the failed pack job %s", job.id)
+
+
+def start_pack_job(bot, job: PackJob) -> None:
+
+    task = asyncio.create_task(run_pack_job(bot, job), name=f"pack_job_{job.id}")
+    task.add_done_callback(lambda _: pack_jobs.pop(job.id, None))
+
+    pack_jobs[job.id] = task
+
+
+@send_action(ChatAction.CHOOSE_STICKER)
+async def download_pack(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+
+    set_name = update.callback_query.data.split(":")[1]
+
+    logger.info("Download pack: %s", set_name)
+
+    popular_sets.hit(set_name)
+
+    try:
+        await get_sticker_set(context.bot, set_name)
+    except TimedOut:
+        logger.error("Timed out while getting the sticker set")
+        await update.callback_query.message.reply_text(
+            text="❌ Error while getting the sticker set"
+        )
+        return
+
+    job = PackJob(
+        set_name=set_name,
+        chat_id=update.effective_message.chat_id,
+        message_id=update.callback_query.message.message_id,
+    )
+
+    # e.g. a restored button clicked while the job was resumed after a restart
+    already_running = job.id in pack_jobs
+
+    if not already_running and admission.full():
+        logger.info("Rejecting pack job, %s jobs queued", MAX_QUEUED_JOBS)
+        await update.callback_query.answer(
+            text="🚦 Too many downloads right now, try again in a few minutes",
+            show_alert=True,
+        )
+        return
+
+    await update.callback_query.edit_message_reply_markup(
+        reply_markup=InlineKeyboardMarkup(
+            [[InlineKeyboardButton(text="⏳ Downloading...", callback_data="wait")]]
+        )
+    )
+
+    if already_running:
+        await update.callback_query.answer(text="⏳ Already downloading this pack")
+        return
+
+    # A job that failed before resumes from its checkpoints
+    job = job_store.load(job.id) or job
+
+    # Runs outside the update so shutdown doesn't wait for the whole pack
+    job_store.save(job)
+    start_pack_job(context.bot, job)
+
+
+async def prewarm_pack(bot, sticker_set):
+    """Convert the pack one part at a time, each part in its own admission
+    slot. Returns None as soon as a user download or pressure shows up."""
+
+    parts = []
+    held = 0
+    try:
+        for part_number, part in enumerate(chunks(sticker_set.stickers, 30), start=1):
+
+            if pack_jobs or not admission.try_acquire():
+                return None
+
+            try:
+                zip_buffer = await convert_part(
+                    bot, sticker_set, part, part_number, notify=False
+                )
+            finally:
+                admission.done()
+
+            if zip_buffer is None:
+                return None
+
+            data = zip_buffer.getvalue()
+            parts.append((zip_buffer.name, data))
+            admission.hold(len(data))
+            held += len(data)
+
+        return parts
+    finally:
+        admission.release(held)
+
+
+async def prewarm_sticker_packs(bot) -> None:
+    """Fetch and convert the most popular sticker packs while the bot is idle,
+    so the first click on a trending pack is served from cache."""
+
+    while True:
+        await asyncio.sleep(PREWARM_INTERVAL)
+
+        # Every tick, even skipped ones, so old trends fade on a busy bot too
+        popular_sets.decay()
+
+        if pack_jobs:
+            logger.info("Skipping prewarm, %s downloads in progress", len(pack_jobs))
+            continue
+
+        reason = admission.pressure()
+        if reason:
+            logger.info("Skipping prewarm, under pressure: %s", reason)
+            continue
+
+        for set_name in popular_sets.top(PREWARM_TOP):
+
+            if set_name in sticker_packs:
+                continue
+
+            logger.info("Prewarming sticker pack: %s", set_name)
+
+            try:
+                sticker_set = await get_sticker_set(bot, set_name)
+
+                if not convertible(sticker_set):
+                    logger.info("Not prewarming animated pack: %s", set_name)
+                    popular_sets.forget(set_name)
+                    continue
+
+                parts = await prewarm_pack(bot, sticker_set)
+
+            # A bad pack must not end the prewarm task
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Error while prewarming the sticker pack %s", set_name)
+                popular_sets.forget(set_name)
+                continue
+
+            if parts is None:
+                logger.info("Prewarm paused, the bot is busy")
+                break
+
+            sticker_packs.set(set_name, parts)
+
+
+async def post_init(application: Application) -> None:
+
+    application.bot_data["prewarm_task"] = asyncio.create_task(
+        prewarm_sticker_packs(application.bot)
+    )
+
+    watchdog.on_block = partial(report_loop_block, application.bot)
+    application.bot_data["watchdog_task"] = asyncio.create_task(watchdog.run())
+
+    for job in job_store.load_all():
+        logger.info("Resuming pack job %s", job.id)
+        start_pack_job(application.bot, job)
+
+
+async def post_stop(application: Application) -> None:
+    """Let pack jobs finish their in-flight uploads before the bot shuts down."""
+
+    stopping.set()
+
+    profile_task = application.bot_data.get("profile_task")
+
+    if profile_task:
+        profile_task.cancel()
+
+    if not pack_jobs:
+        return
+
+    logger.info("Waiting for %s pack jobs to checkpoint", len(pack_jobs))
+
+    _, pending = await asyncio.wait(list(pack_jobs.values()), timeout=SHUTDOWN_TIMEOUT)
+
+    for task in pending:
+        task.cancel()
+
+
+async def post_shutdown(application: Application) -> None:
+
+    for name in ("prewarm_task", "watchdog_task"):
+        task = application.bot_data.get(name)
+
+        if task:
+            task.cancel()
+
+
+async def report_loop_block(bot, blocked: float, stack: str) -> None:
+
+    if DEVELOPER_CHAT_ID:
+        await bot.send_message(
+            chat_id=DEVELOPER_CHAT_ID,
+            text=(
+                f"🐢 Event loop blocked for {blocked:.3f}s\n"
+                f"<pre>{html.escape(stack[-3500:])}</pre>"
+            ),
+            parse_mode="HTML",
+        )
+
+
+def developer_chat_filter():
+    """Filter matching DEVELOPER_CHAT_ID, a chat id or an @username."""
+
+    if not DEVELOPER_CHAT_ID:
+        return None
+
+    if DEVELOPER_CHAT_ID.startswith("@"):
+        return filters.Chat(username=DEVELOPER_CHAT_ID)
+
+    try:
+        return filters.Chat(chat_id=int(DEVELOPER_CHAT_ID))
+    except ValueError:
+        logger.warning(
+            "DEVELOPER_CHAT_ID %s is not a chat id or @username, /profile is disabled",
+            DEVELOPER_CHAT_ID,
+        )
+        return None
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Profile the bot for N seconds and send the report to the developer."""
+
+    if is_profiling():
+        await update.message.reply_text(text="🔬 A profile is already running")
+        return
+
+    try:
+        seconds = int(context.args[0]) if context.args else 30
+    except ValueError:
+        await update.message.reply_text(text="Usage: /profile [seconds]")
+        return
+
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+
+    await update.message.reply_text(text=f"🔬 Profiling for {seconds} seconds")
+
+    # A plain task, not create_task, so a long profile never delays shutdown
+    context.bot_data["profile_task"] = asyncio.create_task(
+        send_profile(update, seconds)
+    )
+
+
+async def send_profile(update: Update, seconds: int) -> None:
+
+    try:
+        report = await profile(seconds)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Error while profiling")
+        return
+
+    document = io.BytesIO(
+        f"{report}\n=== Event loop blocks ===\n{watchdog.report()}".encode()
+    )
+    document.name = f"profile_{seconds}s.txt"
+
+    try:
+        await update.message.reply_document(document=document)
+    except TelegramError:
+        logger.exception("Error while sending the profile")
 
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -573,10 +1119,22 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
         )
 
 
-app = ApplicationBuilder().token(BOT_TOKEN).build()
+app = (
+    ApplicationBuilder()
+    .token(BOT_TOKEN)
+    .post_init(post_init)
+    .post_stop(post_stop)
+    .post_shutdown(post_shutdown)
+    .build()
+)
 
 app.add_handler(CommandHandler("start", start_command))
 
+developer_chat = developer_chat_filter()
+
+if developer_chat:
+    app.add_handler(CommandHandler("profile", profile_command, filters=developer_chat))
+
 app.add_handler(MessageHandler(filters.TEXT, text_handler))
 
 app.add_handler(MessageHandler(filters.Sticker.ALL, sticker_handler))
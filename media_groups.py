@@ -0,0 +1,51 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, List, Optional
+
+
+class MediaGroupAggregator:
+    """Buffers the messages of a media group (album) and calls `on_flush` once
+    with all of them, `delay` seconds after the last one arrived.
+
+    `add` returns the coroutine that flushes the group for its first message,
+    the caller schedules it, e.g. with `Application.create_task` so errors
+    reach the error handlers and pending albums are answered on shutdown.
+
+    Example:
+        ```python
+         albums = MediaGroupAggregator(delay=1, on_flush=reply_album)
+         flush = albums.add(message.media_group_id, item)
+         if flush:
+             application.create_task(flush, update=update)
+        ```
+    """
+
+    def __init__(self, delay: float, on_flush: Callable[[List], Awaitable]):
+        self.delay = delay
+        self.on_flush = on_flush
+        self._groups = {}
+        self._last_seen = {}
+
+    def add(self, group_id: str, item) -> Optional[Awaitable]:
+
+        first = group_id not in self._groups
+
+        self._groups.setdefault(group_id, []).append(item)
+        self._last_seen[group_id] = time.monotonic()
+
+        return self._flush_later(group_id) if first else None
+
+    async def _flush_later(self, group_id: str):
+
+        while True:
+            wait = self._last_seen[group_id] + self.delay - time.monotonic()
+
+            if wait <= 0:
+                break
+
+            await asyncio.sleep(wait)
+
+        del self._last_seen[group_id]
+        items = self._groups.pop(group_id)
+
+        await self.on_flush(items)
@@ -0,0 +1,153 @@
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+_profiling = asyncio.Lock()
+
+
+def is_profiling() -> bool:
+    return _profiling.locked()
+
+
+async def profile(seconds: float, limit: int = 40) -> str:
+    """Profile everything the event loop runs during `seconds` and return
+    the top functions by own time and by cumulative time."""
+
+    async with _profiling:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream).strip_dirs()
+
+    stream.write(f"Profiled {seconds}s\n\n=== By own time ===\n")
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(limit)
+
+    stream.write("\n=== By cumulative time ===\n")
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+
+    return stream.getvalue()
+
+
+class LoopWatchdog:
+    """Measures event loop lag and reports callbacks that block the loop
+    longer than `threshold` (0 only measures the lag).
+
+    A coroutine refreshes a heartbeat every `interval` seconds and passes how
+    late it woke up to `on_lag`. A daemon thread sleeps until the next beat is
+    `threshold` late; if it is, the thread grabs the stack of the loop
+    thread, which points at the blocking call (Pillow, big logs, ...). Once
+    the loop is free again the block is logged and passed to `on_block`, at
+    most once every `report_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        interval: float = 0.5,
+        on_lag: Optional[Callable[[float], None]] = None,
+        on_block: Optional[Callable[[float, str], Awaitable]] = None,
+        report_interval: float = 60,
+    ):
+        self.threshold = threshold
+        self.interval = interval
+        self.on_lag = on_lag
+        self.on_block = on_block
+        self.report_interval = report_interval
+        self.blocks = deque(maxlen=20)
+
+        self._beat = time.monotonic()
+        self._stack = None
+        self._last_report = 0.0
+        self._thread_id = None
+        self._stopped = threading.Event()
+
+    def _watch(self):
+
+        while True:
+            beat = self._beat
+            deadline = beat + self.interval + self.threshold
+
+            if self._stopped.wait(max(0.0, deadline - time.monotonic())):
+                return
+
+            if self._beat != beat:
+                continue
+
+            # pylint: disable=protected-access
+            frame = sys._current_frames().get(self._thread_id)
+
+            if frame:
+                self._stack = "".join(traceback.format_stack(frame))
+
+            # Wait for the loop to come back before watching again
+            while self._beat == beat:
+                if self._stopped.wait(self.interval):
+                    return
+
+    async def run(self):
+
+        self._thread_id = threading.get_ident()
+
+        if self.threshold:
+            threading.Thread(
+                target=self._watch, name="loop-watchdog", daemon=True
+            ).start()
+
+        try:
+            while True:
+                self._beat = time.monotonic()
+                await asyncio.sleep(self.interval)
+
+                blocked = time.monotonic() - self._beat - self.interval
+
+                if self.on_lag:
+                    self.on_lag(blocked)
+
+                if self.threshold and blocked >= self.threshold:
+                    await self._report(blocked, self._stack or "Stack not captured")
+
+                self._stack = None
+        finally:
+            self._stopped.set()
+
+    async def _report(self, blocked: float, stack: str):
+
+        logger.warning("Event loop blocked for %.3fs at:\n%s", blocked, stack)
+
+        self.blocks.append((time.strftime("%Y-%m-%d %H:%M:%S"), blocked, stack))
+
+        now = time.monotonic()
+
+        if self.on_block and now - self._last_report >= self.report_interval:
+            self._last_report = now
+
+            try:
+                await self.on_block(blocked, stack)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Error while reporting a blocked event loop")
+
+    def report(self) -> str:
+        """Text with the latest blocks of the event loop."""
+
+        if not self.blocks:
+            return "No event loop blocks recorded\n"
+
+        return "".join(
+            f"--- {when} blocked {blocked:.3f}s ---\n{stack}\n"
+            for when, blocked, stack in self.blocks
+        )
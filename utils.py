@@ -67,6 +67,10 @@ def text_html(contents: List[Tuple]):
     return "\n".join(message)
 
 
+def pack_filename(set_name: str, part: int):
+    return f"{set_name}.part{part}.wastickers"
+
+
 async def create_zip(
     set_name: str, part: int, title: str, bot_username: str, stickers: List[dict]
 ):
@@ -84,7 +88,7 @@ async def create_zip(
             zf.writestr(sticker_filename, sticker_file.read())
 
     zip_buffer.seek(0)
-    zip_buffer.name = f"{set_name}.part{part}.wastickers"
+    zip_buffer.name = pack_filename(set_name, part)
     return zip_buffer
 
 